@@ -1,45 +1,281 @@
+import os
+
+# Cap BLAS/OpenMP pools before numpy/TF are imported; with Flask's threaded
+# server every request thread would otherwise fan out an all-cores parallel
+# region and the resulting oversubscription slows the DNNs down.
+os.environ.setdefault("OMP_NUM_THREADS", "2")
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "2")
+os.environ.setdefault("MKL_NUM_THREADS", "2")
+
 from flask import Flask, render_template, Response, request, redirect, url_for, jsonify
 import cv2
 import joblib
 import numpy as np
-import os
 import csv
+import json
+import itertools
 from keras_facenet import FaceNet
 from mtcnn import MTCNN
-from sklearn.metrics.pairwise import cosine_similarity
 from datetime import datetime, timedelta
+from functools import lru_cache
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
 import traceback
 
+try:
+    from _cosine_numba import topk_best_match as _best_match
+except ImportError:  # numba is optional; the NumPy path is used without it
+    _best_match = None
+import threading
+import queue
+import time
+
+# Leave cores free for the capture thread and Flask workers so OpenCV's
+# internal parallelism does not oversubscribe the machine.
+cv2.setNumThreads(2)
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": ["http://localhost:5173", "http://127.0.0.1:5173", "http://localhost:5174", "http://localhost:5175"]}})
 
 # -------------------- Config --------------------
-DATABASE_PATH = "face_database_multiple.joblib"
+DATABASE_PATH = "face_database_multiple.joblib"  # legacy, migrated on load
+EMBEDDINGS_PATH = "face_embeddings.npy"
+PEOPLE_INDEX_PATH = "face_people.json"
 ATTENDANCE_FOLDER = "./"
 THRESHOLD = 0.75
 KNN_NEIGHBORS = 5
 BOX_DISPLAY_TIME = 2  # seconds
 CAPTURE_COUNT = 150
-FRAME_SKIP_INTERVAL = 5 # Process every 5th frame
-UPLOAD_FOLDER = "uploads"
+FRAME_SKIP_INTERVAL = 5 # Run the detector every 5th frame; track in between
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
+MAX_FACES = 8  # most faces embedded per frame
+DETECT_SCALE = 0.5  # detector runs on a downscaled frame; boxes scale back up
+# Quality 70 is plenty for a browser preview and roughly halves encode time
+# while cutting payload size 3-4x vs the default 95.
+JPEG_ENC_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 70]
+
+# Reusable ROI batch buffer: resizing into preallocated rows avoids ~75 KB of
+# allocations per face per frame. Only touched by the processing thread.
+BATCH_BUF = np.empty((MAX_FACES, 160, 160, 3), np.uint8)
 
 # -------------------- Load DB --------------------
-if os.path.exists(DATABASE_PATH):
+def normalized_embeddings(embeddings):
+    """Return embeddings as one contiguous float32 matrix with unit-norm rows."""
+    arr = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+    if arr.ndim == 1:
+        arr = arr[None, :]
+    arr /= np.linalg.norm(arr, axis=1, keepdims=True)
+    return arr
+
+def load_database():
+    """Load the persisted face database.
+
+    Prefers the mem-mappable .npy matrix + JSON person index; the rows come
+    in normalized, and np.load(mmap_mode='r') makes startup near-free. Falls
+    back to (and migrates from) the legacy joblib pickle.
+    """
+    if os.path.exists(EMBEDDINGS_PATH) and os.path.exists(PEOPLE_INDEX_PATH):
+        try:
+            mat = np.load(EMBEDDINGS_PATH, mmap_mode="r")
+            with open(PEOPLE_INDEX_PATH) as f:
+                people = json.load(f)["people"]
+            db = {name: mat[start:end] for name, start, end in people}
+            print(f"Loaded database with {len(db)} people")
+            return db
+        except Exception:
+            pass
+    if os.path.exists(DATABASE_PATH):
+        try:
+            legacy = joblib.load(DATABASE_PATH)
+            print(f"Loaded legacy joblib database with {len(legacy)} people")
+            # Legacy databases stored raw Python lists of embeddings;
+            # normalize them once here.
+            return {name: normalized_embeddings(embs)
+                    for name, embs in legacy.items() if len(embs) > 0}
+        except Exception:
+            return {}
+    return {}
+
+database = load_database()
+
+# -------------------- Embedder --------------------
+# Offline exports of FaceNet, produced once with tf2onnx; the INT8 variant
+# additionally goes through onnxruntime.quantization.quantize_dynamic. When
+# neither file is present we fall back to the original Keras model.
+FACENET_ONNX_INT8_PATH = "facenet_int8.onnx"
+FACENET_ONNX_FP32_PATH = "facenet.onnx"
+
+class OnnxFaceNet:
+    """FaceNet served by ONNX Runtime, same .embeddings() interface as keras_facenet."""
+
+    def __init__(self, model_path):
+        import onnxruntime as ort
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        so.intra_op_num_threads = os.cpu_count() or 1
+        # Prefer TensorRT (FP16, cached engines), then CUDA, then CPU —
+        # batched embeds become a single GPU kernel launch where available.
+        available = ort.get_available_providers()
+        providers = []
+        if "TensorrtExecutionProvider" in available:
+            providers.append(("TensorrtExecutionProvider",
+                              {"trt_fp16_enable": True,
+                               "trt_engine_cache_enable": True}))
+        if "CUDAExecutionProvider" in available:
+            providers.append("CUDAExecutionProvider")
+        providers.append("CPUExecutionProvider")
+        self.session = ort.InferenceSession(
+            model_path, providers=providers, sess_options=so)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def embeddings(self, batch):
+        batch = np.asarray(batch, dtype=np.float32) / 127.5 - 1.0
+        return self.session.run(None, {self.input_name: batch})[0]
+
+def _pin_tf_threads():
+    """Bound TensorFlow's op parallelism (no-op once the TF context is live)."""
     try:
-        database = joblib.load(DATABASE_PATH)
-        print(f"Loaded database with {len(database)} people")
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(2)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
     except Exception:
-        database = {}
-else:
-    database = {}
+        pass
 
-embedder = FaceNet()
+def _build_embedder():
+    try:
+        import onnxruntime as ort
+        gpu = any(p in ort.get_available_providers()
+                  for p in ("TensorrtExecutionProvider", "CUDAExecutionProvider"))
+    except ImportError:
+        _pin_tf_threads()
+        return FaceNet()
+    # On GPU the FP32 export (run as FP16 by TensorRT) beats the INT8 one,
+    # which is quantized for CPU VNNI throughput.
+    candidates = ((FACENET_ONNX_FP32_PATH, FACENET_ONNX_INT8_PATH) if gpu
+                  else (FACENET_ONNX_INT8_PATH, FACENET_ONNX_FP32_PATH))
+    for model_path in candidates:
+        if os.path.exists(model_path):
+            try:
+                onnx_embedder = OnnxFaceNet(model_path)
+                print(f"Loaded FaceNet via ONNX Runtime: {model_path} "
+                      f"({onnx_embedder.session.get_providers()[0]})")
+                return onnx_embedder
+            except Exception as e:
+                print(f"Could not load {model_path}: {e}")
+    _pin_tf_threads()
+    return FaceNet()
+
+embedder = _build_embedder()
+_pin_tf_threads()  # MTCNN is TF-backed too
 detector = MTCNN()
 
+# Warm both models now so no user request pays the multi-second graph
+# build / weight load. For production, run `gunicorn --preload -w N main:app`
+# so workers fork after this point and COW-share the loaded weights
+# (the dev server's threaded=True is for development only).
+try:
+    _ = embedder.embeddings(np.zeros((1, 160, 160, 3), np.uint8))
+    _ = detector.detect_faces(np.zeros((160, 160, 3), np.uint8))
+except Exception as e:
+    print(f"Model warmup failed: {e}")
+
+# Single-pass YuNet detector for the webcam stream; MTCNN stays on the
+# enrollment path where latency is not critical.
+YUNET_MODEL_PATH = "face_detection_yunet_2023mar.onnx"
+face_detector_yn = None
+if os.path.exists(YUNET_MODEL_PATH):
+    try:
+        face_detector_yn = cv2.FaceDetectorYN.create(
+            YUNET_MODEL_PATH, "", (320, 240), score_threshold=0.9)
+        print("Loaded YuNet face detector")
+    except Exception:
+        face_detector_yn = None
+_yn_input_size = None
+
+def detect_stream_faces(frame_bgr):
+    """Detect faces in a stream frame, returning (x, y, w, h, confidence) boxes.
+
+    YuNet consumes the BGR frame directly, so no full-frame colorspace
+    conversion is needed. Only the MTCNN fallback pays for an RGB copy.
+    """
+    global _yn_input_size
+    if face_detector_yn is not None:
+        h, w = frame_bgr.shape[:2]
+        if _yn_input_size != (w, h):
+            face_detector_yn.setInputSize((w, h))
+            _yn_input_size = (w, h)
+        _, faces = face_detector_yn.detect(frame_bgr)
+        if faces is None:
+            return []
+        return [(int(f[0]), int(f[1]), int(f[2]), int(f[3]), float(f[14]))
+                for f in faces]
+    boxes = []
+    rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+    for face in detector.detect_faces(rgb):
+        x, y, w, h = face.get('box', (0, 0, 0, 0))
+        boxes.append((x, y, w, h, face.get('confidence', 0)))
+    return boxes
+
+# -------------------- Recognition index --------------------
+# Flat view of `database` so one matrix-vector product scores every stored
+# embedding at once instead of one cosine_similarity call per person.
+# Published as a single immutable (matrix, slices) tuple that writers swap
+# atomically — the hot path reads it once, without taking any lock.
+# ((M, 512) float32 unit-norm rows, [(name, start, end)], starts, ends)
+DB_SNAPSHOT = (None, [], None, None)
+_db_lock = threading.RLock()  # serializes database mutation + snapshot rebuild
+
+def rebuild_recognition_index():
+    """Rebuild the stacked embedding matrix from `database`.
+
+    Must be called (under _db_lock) after the database is loaded and after
+    every add/delete. The new snapshot is fully built before the single
+    atomic rebind, so concurrent readers see either the old or new index.
+    """
+    global DB_SNAPSHOT
+    chunks, slices, start = [], [], 0
+    for person, embeddings_list in database.items():
+        if len(embeddings_list) == 0:
+            continue
+        arr = np.asarray(embeddings_list, dtype=np.float32)
+        chunks.append(arr)
+        slices.append((person, start, start + len(arr)))
+        start += len(arr)
+    if not chunks:
+        DB_SNAPSHOT = (None, [], None, None)
+        return
+    # Rows are already unit-norm (normalized_embeddings at ingest/load), so
+    # the matrix @ q product is directly the cosine similarity.
+    DB_SNAPSHOT = (np.ascontiguousarray(np.vstack(chunks), dtype=np.float32),
+                   slices,
+                   np.array([s for _, s, _ in slices], np.int64),
+                   np.array([e for _, _, e in slices], np.int64))
+
+rebuild_recognition_index()
+
+def save_database():
+    """Persist the flat embedding matrix + person index atomically.
+
+    Writes a mem-mappable .npy plus a small JSON index (name -> row range)
+    instead of re-pickling the whole database; both files go through a tmp
+    path + os.replace so readers never see a half-written file.
+    """
+    all_emb, person_slices = DB_SNAPSHOT[:2]
+    if all_emb is None:
+        for path in (EMBEDDINGS_PATH, PEOPLE_INDEX_PATH):
+            if os.path.exists(path):
+                os.remove(path)
+        return
+    tmp_npy = EMBEDDINGS_PATH + ".tmp"
+    with open(tmp_npy, "wb") as f:
+        np.save(f, np.asarray(all_emb))
+    os.replace(tmp_npy, EMBEDDINGS_PATH)
+
+    tmp_json = PEOPLE_INDEX_PATH + ".tmp"
+    with open(tmp_json, "w") as f:
+        json.dump({"people": [[name, start, end]
+                              for name, start, end in person_slices]}, f)
+    os.replace(tmp_json, PEOPLE_INDEX_PATH)
+
 # -------------------- Attendance CSV --------------------
 date_str = datetime.now().strftime("%Y-%m-%d")
 filename = os.path.join(ATTENDANCE_FOLDER, f"attendance_{date_str}.csv")
@@ -48,8 +284,50 @@ if not os.path.exists(filename):
         writer = csv.writer(f)
         writer.writerow(["Name", "Time"])
 
-marked = set()
+marked = {}  # name -> first-seen time for today
 display_timers = {}
+state_lock = threading.Lock()  # guards marked / display_timers across threads
+_attendance_dirty = False
+ATTENDANCE_FLUSH_INTERVAL = 5  # seconds
+
+# Warm-load any records already written today (e.g. after a restart) so the
+# periodic rewrite never drops them.
+if os.path.exists(filename):
+    with open(filename, "r") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) >= 2:
+                marked.setdefault(row[0], row[1])
+
+_flush_lock = threading.Lock()  # serializes the flusher thread and api_stop
+
+def flush_attendance():
+    """Rewrite today's CSV from the in-memory records in one writerows call.
+
+    Goes through a tmp path + os.replace (the save_database idiom) so a
+    crash mid-rewrite or two concurrent flushes can never tear the file the
+    startup warm-load depends on.
+    """
+    global _attendance_dirty
+    with _flush_lock:
+        with state_lock:
+            records = list(marked.items())
+            _attendance_dirty = False
+        tmp_path = filename + ".tmp"
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Name", "Time"])
+            writer.writerows(records)
+        os.replace(tmp_path, filename)
+
+def _attendance_flusher():
+    while True:
+        time.sleep(ATTENDANCE_FLUSH_INTERVAL)
+        if _attendance_dirty:
+            flush_attendance()
+
+threading.Thread(target=_attendance_flusher, daemon=True).start()
 
 # Control flags
 camera_active = False
@@ -60,164 +338,278 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def process_uploaded_image(image_file):
-    """Process uploaded image and extract face embedding"""
+    """Process uploaded image and extract the resized face ROI.
+
+    Returns the 160x160 RGB crop; the caller embeds all uploads in one batch.
+    The upload is decoded straight from the request stream — no temp file,
+    no disk round trip.
+    """
     try:
-        # Save the uploaded file temporarily
-        filename = secure_filename(image_file.filename)
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        image_file.save(filepath)
-        
-        # Read and process the image
-        img = cv2.imread(filepath)
+        buf = np.frombuffer(image_file.read(), np.uint8)
+        img = cv2.imdecode(buf, cv2.IMREAD_COLOR)
         if img is None:
-            os.remove(filepath)  # Clean up
             return None, "Could not read the uploaded image"
-            
+
         rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         faces = detector.detect_faces(rgb)
-        
+
         if not faces:
-            os.remove(filepath)  # Clean up
             return None, "No face detected in the uploaded image"
-            
+
         # Get the first detected face
         face = faces[0]
         confidence = face.get('confidence', 0)
-        
+
         if confidence < 0.9:
-            os.remove(filepath)  # Clean up
             return None, f"Face detection confidence too low: {confidence:.2f}"
-            
+
         x, y, w, h = face.get('box', (0, 0, 0, 0))
         x, y = max(0, x), max(0, y)
         w, h = max(1, w), max(1, h)
         roi = rgb[y:y+h, x:x+w]
-        
+
         if roi.size == 0:
-            os.remove(filepath)  # Clean up
             return None, "Invalid face region detected"
-            
-        # Generate face embedding
-        face_resized = cv2.resize(roi, (160, 160))
-        embedding = embedder.embeddings([face_resized])[0]
-        
-        # Clean up temporary file
-        os.remove(filepath)
-        
-        return embedding, None
-        
+
+        return cv2.resize(roi, (160, 160)), None
+
     except Exception as e:
-        # Clean up temporary file if it exists
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
         return None, f"Error processing image: {str(e)}"
 
 def mark_attendance(name):
-    if attendance_active and name not in marked and name != "Unknown":
+    global _attendance_dirty
+    if attendance_active and name != "Unknown":
         now = datetime.now().strftime("%H:%M:%S")
-        with open(filename, "a", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow([name, now])
-        marked.add(name)
+        with state_lock:
+            if name in marked:
+                return
+            marked[name] = now
+            _attendance_dirty = True
         print(f"{name} marked at {now}")
 
 def recognize_face(face_embedding, database, threshold=THRESHOLD, k_neighbors=KNN_NEIGHBORS):
-    best_score, best_person = -1, "Unknown"
-    for person, embeddings_list in database.items():
-        if len(embeddings_list) == 0:
-            continue
-        k = min(k_neighbors, len(embeddings_list))
-        try:
-            sims = cosine_similarity([face_embedding], embeddings_list)
-            top_k_sim = np.sort(sims[0])[-k:]
+    # One consistent snapshot for the whole call; writers swap DB_SNAPSHOT
+    # atomically, so no lock is needed on this hot path.
+    all_emb, person_slices, starts, ends = DB_SNAPSHOT
+    if all_emb is None:
+        return "Unknown"
+    q = np.asarray(face_embedding, dtype=np.float32)
+    q = q / np.sqrt(np.vdot(q, q))
+    # Single GEMV against every stored embedding; rows are pre-normalized so
+    # the dot product is already the cosine similarity.
+    sims = all_emb @ q
+    if _best_match is not None:
+        best_idx, best_score = _best_match(sims, starts, ends, k_neighbors)
+        best_person = person_slices[best_idx][0]
+    else:
+        best_score, best_person = -1, "Unknown"
+        for person, start, end in person_slices:
+            k = min(k_neighbors, end - start)
+            top_k_sim = np.partition(sims[start:end], -k)[-k:]
             max_sim = np.mean(top_k_sim)
-        except Exception:
-            continue
-        if max_sim > best_score:
-            best_score = max_sim
-            best_person = person
+            if max_sim > best_score:
+                best_score = max_sim
+                best_person = person
     if best_score < threshold:
         return "Unknown"
     return best_person
 
+def _put_latest(q, item):
+    """Put on a maxsize=1 queue, dropping the stale item if the consumer lags."""
+    try:
+        q.put_nowait(item)
+    except queue.Full:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            pass
+
+@lru_cache(maxsize=256)
+def _label_size(label):
+    """Glyph extents for a label; names are stable across adjacent frames so
+    the cache almost always hits."""
+    return cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
+
+def draw_face(frame, name, box, confidence, current_time):
+    """Draw the box + label for one face and handle attendance bookkeeping."""
+    x, y, w, h = box
+    if name != "Unknown":
+        color = (0, 255, 0)  # Green for known faces
+        if attendance_active:
+            mark_attendance(name)
+        with state_lock:
+            display_timers[name] = current_time + timedelta(seconds=BOX_DISPLAY_TIME)
+    else:
+        color = (0, 0, 255)  # Red for unknown faces
+
+    # Draw rectangle and label
+    cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
+
+    # Add background for text readability; one decimal keeps the label text
+    # (and therefore the size cache key) stable between frames
+    label = f"{name} ({confidence:.1f})"
+    label_size = _label_size(label)
+    cv2.rectangle(frame, (x, y-label_size[1]-10), (x+label_size[0], y), color, -1)
+    cv2.putText(frame, label, (x, y-5),
+              cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+
+def _make_tracker():
+    """Create the cheapest available box tracker (MOSSE ~1 ms/face, else KCF)."""
+    if hasattr(cv2, 'legacy'):
+        if hasattr(cv2.legacy, 'TrackerMOSSE_create'):
+            return cv2.legacy.TrackerMOSSE_create()
+        if hasattr(cv2.legacy, 'TrackerKCF_create'):
+            return cv2.legacy.TrackerKCF_create()
+    if hasattr(cv2, 'TrackerKCF_create'):
+        return cv2.TrackerKCF_create()
+    return None
+
+def annotate_frame(frame, current_time):
+    """Detect, recognize and draw boxes for all faces in `frame` (in place).
+
+    Returns the recognized (name, box, confidence) tuples so callers can seed
+    trackers for the frames where the detector is skipped.
+    """
+    results = []
+    try:
+        # Detection cost scales with pixels: run the detector on a downscaled
+        # copy and scale boxes back up for cropping and drawing. Recall on
+        # near-camera attendance faces is unaffected.
+        small = cv2.resize(frame, None, fx=DETECT_SCALE, fy=DETECT_SCALE,
+                           interpolation=cv2.INTER_AREA)
+        faces = detect_stream_faces(small)
+        inv_scale = 1.0 / DETECT_SCALE
+
+        # First pass: collect every confident ROI so all faces in the frame
+        # share a single FaceNet forward pass instead of one call per face.
+        # ROIs are resized straight into the pooled batch buffer.
+        boxes = []
+        for x, y, w, h, confidence in faces:
+            if len(boxes) >= MAX_FACES:
+                break
+            # Only process faces with good confidence (> 0.9)
+            if confidence > 0.9:
+                x, y = int(x * inv_scale), int(y * inv_scale)
+                w, h = int(w * inv_scale), int(h * inv_scale)
+                x, y = max(0, x), max(0, y)
+                x2, y2 = min(frame.shape[1], x + w), min(frame.shape[0], y + h)
+                w, h = x2 - x, y2 - y
+
+                if w > 30 and h > 30:  # Minimum face size
+                    roi = frame[y:y+h, x:x+w]
+
+                    # Ensure ROI has correct shape
+                    if roi.size > 0 and len(roi.shape) == 3 and roi.shape[2] == 3:
+                        cv2.resize(roi, (160, 160), dst=BATCH_BUF[len(boxes)])
+                        boxes.append((x, y, w, h, confidence))
+
+        if not boxes:
+            return results
+
+        try:
+            # FaceNet wants RGB; reversing the channel axis of the tiny
+            # 160x160 crops is ~40x cheaper than converting the whole frame,
+            # and the embedder's float32 cast materializes the view anyway.
+            embs = embedder.embeddings(BATCH_BUF[:len(boxes), :, :, ::-1])
+        except Exception as e:
+            print(f"Face processing error: {e}")
+            # Still draw basic detection boxes
+            for x, y, w, h, confidence in boxes:
+                cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 0, 0), 2)
+                cv2.putText(frame, "Processing...", (x, y-5),
+                          cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+            return results
+
+        for (x, y, w, h, confidence), emb in zip(boxes, embs):
+            name = recognize_face(emb, database)
+            draw_face(frame, name, (x, y, w, h), confidence, current_time)
+            results.append((name, (x, y, w, h), confidence))
+
+    except Exception as e:
+        print(f"Face detection error: {e}")
+    return results
+
+def capture_loop(cap, q_raw, stop_event):
+    """Read frames as fast as the camera delivers them, keeping only the latest."""
+    while camera_active and not stop_event.is_set():
+        success, frame = cap.read()
+        if not success or frame is None:
+            stop_event.set()
+            break
+        _put_latest(q_raw, (frame, datetime.now()))
+
+def process_loop(q_raw, q_out, stop_event):
+    """Run detection + recognition on the freshest captured frame.
+
+    The detector + embedder only run every FRAME_SKIP_INTERVAL-th frame;
+    in between, cheap correlation trackers propagate the last boxes and
+    the cached names are reused for drawing and attendance.
+    """
+    frame_count = 0
+    tracked = []  # (tracker, name, confidence) seeded on each detect frame
+    tracking_supported = _make_tracker() is not None
+    while camera_active and not stop_event.is_set():
+        try:
+            frame, current_time = q_raw.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        frame_count += 1
+
+        if not tracking_supported or frame_count % FRAME_SKIP_INTERVAL == 1:
+            results = annotate_frame(frame, current_time)
+            tracked = []
+            if tracking_supported:
+                for name, box, confidence in results:
+                    tracker = _make_tracker()
+                    try:
+                        tracker.init(frame, box)
+                        tracked.append((tracker, name, confidence))
+                    except Exception:
+                        pass
+        else:
+            for tracker, name, confidence in tracked:
+                ok, box = tracker.update(frame)
+                if ok:
+                    x, y, w, h = (int(v) for v in box)
+                    draw_face(frame, name, (x, y, w, h), confidence, current_time)
+
+        _put_latest(q_out, frame)
+
 def generate_frames():
-    global camera_active, attendance_active
+    global camera_active
     cap = cv2.VideoCapture(0)
     if not cap.isOpened():
         # If camera can't open, stop streaming
         camera_active = False
         return
 
-    try:
-        frame_count = 0
-        while camera_active:
-            success, frame = cap.read()
-            if not success or frame is None:
-                break
+    # capture -> detect+recognize -> encode/yield, connected by maxsize=1
+    # queues with drop-oldest semantics so the preview always shows the
+    # latest frame instead of queueing up behind model inference.
+    stop_event = threading.Event()
+    q_raw = queue.Queue(maxsize=1)
+    q_out = queue.Queue(maxsize=1)
+    workers = [
+        threading.Thread(target=capture_loop, args=(cap, q_raw, stop_event), daemon=True),
+        threading.Thread(target=process_loop, args=(q_raw, q_out, stop_event), daemon=True),
+    ]
+    for worker in workers:
+        worker.start()
 
-            frame_count += 1
-            current_time = datetime.now()
-            
-            # Process every frame for face detection (remove frame skipping for better detection)
+    try:
+        while camera_active and not stop_event.is_set():
             try:
-                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                faces = detector.detect_faces(rgb)
-
-                # Process all detected faces, not just the first one
-                for face in faces:
-                    x, y, w, h = face.get('box', (0, 0, 0, 0))
-                    confidence = face.get('confidence', 0)
-                    
-                    # Only process faces with good confidence (> 0.9)
-                    if confidence > 0.9:
-                        x, y = max(0, x), max(0, y)
-                        x2, y2 = min(frame.shape[1], x + w), min(frame.shape[0], y + h)
-                        w, h = x2 - x, y2 - y
-                        
-                        if w > 30 and h > 30:  # Minimum face size
-                            roi = rgb[y:y+h, x:x+w]
-                            
-                            if roi.size > 0:
-                                try:
-                                    # Ensure ROI has correct shape
-                                    if len(roi.shape) == 3 and roi.shape[2] == 3:
-                                        face_resized = cv2.resize(roi, (160, 160))
-                                        emb = embedder.embeddings([face_resized])[0]
-                                        name = recognize_face(emb, database)
-                                        
-                                        # Always draw bounding box for detected faces
-                                        if name != "Unknown":
-                                            color = (0, 255, 0)  # Green for known faces
-                                            if attendance_active:
-                                                mark_attendance(name)
-                                            display_timers[name] = current_time + timedelta(seconds=BOX_DISPLAY_TIME)
-                                        else:
-                                            color = (0, 0, 255)  # Red for unknown faces
-                                        
-                                        # Draw rectangle and label
-                                        cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
-                                        
-                                        # Add background for text readability
-                                        label = f"{name} ({confidence:.2f})"
-                                        label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
-                                        cv2.rectangle(frame, (x, y-label_size[1]-10), (x+label_size[0], y), color, -1)
-                                        cv2.putText(frame, label, (x, y-5),
-                                                  cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                                        
-                                except Exception as e:
-                                    print(f"Face processing error: {e}")
-                                    # Still draw a basic detection box
-                                    cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 0, 0), 2)
-                                    cv2.putText(frame, "Processing...", (x, y-5),
-                                              cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
-                            
-            except Exception as e:
-                print(f"Face detection error: {e}")
-                pass
+                frame = q_out.get(timeout=0.5)
+            except queue.Empty:
+                continue
 
             # encode and yield
             try:
-                ret, buffer = cv2.imencode('.jpg', frame)
+                ret, buffer = cv2.imencode('.jpg', frame, JPEG_ENC_PARAMS)
                 if ret:
                     frame_bytes = buffer.tobytes()
                     yield (b'--frame\r\n'
@@ -226,6 +618,9 @@ def generate_frames():
                 print(f"Frame encoding error: {e}")
                 continue
     finally:
+        stop_event.set()
+        for worker in workers:
+            worker.join(timeout=1.0)
         cap.release()
 
 # -------------------- Routes (UI) --------------------
@@ -277,41 +672,48 @@ def api_add_person():
         if not files or len(files) == 0:
             return jsonify({"error": "No images uploaded"}), 400
             
-        embeddings = []
+        rois = []
         processed_count = 0
         errors = []
-        
+
         # Process each uploaded image
         for file in files:
             if file and file.filename and allowed_file(file.filename):
-                embedding, error = process_uploaded_image(file)
-                if embedding is not None:
-                    embeddings.append(embedding)
+                roi, error = process_uploaded_image(file)
+                if roi is not None:
+                    rois.append(roi)
                     processed_count += 1
                 else:
                     errors.append(f"File {file.filename}: {error}")
-                    
-        if not embeddings:
+
+        if not rois:
             return jsonify({
                 "error": "No valid faces detected in uploaded images",
                 "details": errors
             }), 400
-            
+
+        # Embed every uploaded face in a single forward pass, normalized at
+        # ingest so recognition never has to renormalize stored rows
+        embeddings = normalized_embeddings(embedder.embeddings(np.stack(rois, axis=0)))
+
         # Add to database
-        if name in database:
-            database[name].extend(embeddings)
-        else:
-            database[name] = embeddings
-            
-        # Save database
-        joblib.dump(database, DATABASE_PATH)
-        
+        with _db_lock:
+            if name in database:
+                database[name] = np.vstack([database[name], embeddings])
+            else:
+                database[name] = embeddings
+
+            # Save database
+            rebuild_recognition_index()
+            save_database()
+            total_embeddings = len(database[name])
+
         response_data = {
             "status": "success",
             "message": f"Successfully added {name} to the database",
             "embeddings_added": len(embeddings),
             "images_processed": processed_count,
-            "total_embeddings": len(database[name])
+            "total_embeddings": total_embeddings
         }
         
         if errors:
@@ -356,15 +758,17 @@ def api_delete_person():
         if not name:
             return jsonify({"error": "Person name is required"}), 400
             
-        if name not in database:
-            return jsonify({"error": f"Person '{name}' not found in database"}), 404
-            
-        # Remove from database
-        del database[name]
-        
-        # Save database
-        joblib.dump(database, DATABASE_PATH)
-        
+        with _db_lock:
+            if name not in database:
+                return jsonify({"error": f"Person '{name}' not found in database"}), 404
+
+            # Remove from database
+            del database[name]
+
+            # Save database
+            rebuild_recognition_index()
+            save_database()
+
         return jsonify({
             "status": "success",
             "message": f"Successfully deleted {name} from the database"
@@ -389,18 +793,29 @@ def api_stop():
     global camera_active, attendance_active
     camera_active = False
     attendance_active = False
+    flush_attendance()
     return jsonify({"status": "Camera stopped, attendance stopped"})
 
 @app.route('/api/attendance', methods=['GET'])
 def api_attendance():
-    records = []
-    if os.path.exists(filename):
-        with open(filename, "r") as f:
-            reader = csv.reader(f)
-            next(reader, None)
-            for row in reader:
-                records.append({"name": row[0], "time": row[1]})
-    return jsonify({"date": date_str, "records": records})
+    # marked holds everything written today (warm-loaded from the CSV at
+    # startup), so no disk read or CSV parse is needed per request. Optional
+    # ?limit/&offset keep the response bounded as the day's list grows.
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        offset = 0
+    try:
+        limit = int(request.args.get('limit', 0))
+    except ValueError:
+        limit = 0
+    with state_lock:
+        total = len(marked)
+        items = itertools.islice(
+            marked.items(), offset,
+            offset + limit if limit > 0 else None)
+        records = [{"name": name, "time": t} for name, t in items]
+    return jsonify({"date": date_str, "total": total, "records": records})
 
 @app.route('/api/status', methods=['GET'])
 def api_status():
@@ -411,5 +826,4 @@ def api_status():
     })
 
 if __name__ == "__main__":
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     app.run(debug=True, host='127.0.0.1', port=5000, threaded=True)